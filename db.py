@@ -1,24 +1,153 @@
+import itertools
 import os
+import queue
 import sqlite3
+import time
 from contextlib import contextmanager
-from datetime import datetime, timezone
 
 DB_PATH = os.getenv("DB_PATH", "app.db")
 
-def _utc_date_str() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+# Per-connection tuning; journal_mode=WAL is persistent and set once in init_db()
+_CONN_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA wal_autocheckpoint=1000",
+    "PRAGMA busy_timeout=5000",
+)
+OPTIMIZE_EVERY = 1000
+_conn_counter = itertools.count(1)
+
+def _is_memory_db() -> bool:
+    return DB_PATH == ":memory:" or DB_PATH.startswith("file::memory:")
+
+# (valid_until_epoch_second, formatted) pairs; swapping a tuple is atomic, so no lock
+_now_cache: tuple[int, str] = (0, "")
+_day_cache: tuple[int, str] = (0, "")
+
+def _now_iso() -> str:
+    global _now_cache
+    sec = int(time.time())
+    if sec != _now_cache[0]:
+        t = time.gmtime(sec)
+        # same text as datetime.isoformat() on an aware UTC datetime, without strftime
+        _now_cache = (sec, f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}"
+                           f"T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}+00:00")
+    return _now_cache[1]
+
+def utc_date_str() -> str:
+    global _day_cache
+    sec = int(time.time())
+    if sec >= _day_cache[0]:
+        next_midnight = sec - sec % 86400 + 86400
+        t = time.gmtime(sec)
+        _day_cache = (next_midnight, f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}")
+    return _day_cache[1]
+
+# Statements are module-level constants so every pooled connection's statement
+# cache (keyed by SQL text) hits instead of re-preparing them per call.
+SQL_GET_EMAIL = "SELECT email FROM device_email WHERE device_id=?"
+SQL_SET_EMAIL = """
+    INSERT INTO device_email(device_id, email, verified, updated_at)
+    VALUES(?,?,1,?)
+    ON CONFLICT(device_id) DO UPDATE SET
+      email=excluded.email,
+      verified=1,
+      updated_at=excluded.updated_at
+"""
+SQL_GET_TOTAL = "SELECT total_count FROM usage_total WHERE device_id=?"
+SQL_INC_TOTAL = """
+    INSERT INTO usage_total(device_id, total_count, created_at)
+    VALUES(?,?,?)
+    ON CONFLICT(device_id) DO UPDATE SET total_count = total_count + excluded.total_count
+"""
+SQL_INC_GET_TOTAL = SQL_INC_TOTAL + "RETURNING total_count"
+# conditional UPSERT: the update only applies while the new count stays within the cap,
+# so check and increment are one statement; a capped row returns nothing
+SQL_CONSUME_TOTAL = SQL_INC_TOTAL + "WHERE total_count + excluded.total_count <= ? RETURNING total_count"
+SQL_GET_DAILY = "SELECT count FROM usage_daily WHERE device_id=? AND day=?"
+SQL_INC_DAILY = """
+    INSERT INTO usage_daily(device_id, day, count)
+    VALUES(?,?,?)
+    ON CONFLICT(device_id, day) DO UPDATE SET count = count + excluded.count
+"""
+SQL_INC_GET_DAILY = SQL_INC_DAILY + "RETURNING count"
+SQL_CONSUME_DAILY = SQL_INC_DAILY + "WHERE count + excluded.count <= ? RETURNING count"
+SQL_CREATE_LICENSE = """
+    INSERT INTO licenses(license_key, email, plan, device_id, created_at, bound_at, email_status)
+    VALUES(?,?,?,?,?,NULL,'pending')
+"""
+SQL_SET_LICENSE_EMAIL_STATUS = "UPDATE licenses SET email_status=? WHERE license_key=?"
+SQL_GET_LICENSE_DEVICE = "SELECT device_id FROM licenses WHERE license_key=?"
+SQL_BIND_LICENSE = "UPDATE licenses SET device_id=?, bound_at=? WHERE license_key=?"
+# the plan='paid' term must stay: it is what lets SQLite use the partial index
+SQL_IS_PAID = "SELECT 1 FROM licenses INDEXED BY idx_licenses_device_paid WHERE device_id=? AND plan='paid' LIMIT 1"
+STATEMENT_CACHE_SIZE = 128
+
+class ConnectionPool:
+    """LIFO pool of long-lived connections so the page cache stays warm."""
+
+    def __init__(self, path: str, max_idle: int = 8):
+        self.path = path
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=max_idle)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in _CONN_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+_pool = ConnectionPool(DB_PATH, max_idle=int(os.getenv("DB_POOL_SIZE", "8")))
 
 @contextmanager
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    # a borrowed connection is owned exclusively until it is released
+    conn = _pool.acquire()
     try:
         yield conn
         conn.commit()
+        if next(_conn_counter) % OPTIMIZE_EVERY == 0:
+            conn.execute("PRAGMA optimize")
+    except BaseException:
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        _pool.release(conn)
+
+def optimize():
+    with get_conn() as conn:
+        conn.execute("PRAGMA optimize")
+
+def close_pool():
+    optimize()
+    _pool.close_all()
 
 def init_db():
     with get_conn() as conn:
+        if not _is_memory_db():
+            conn.execute("PRAGMA journal_mode=WAL")
+
         cur = conn.cursor()
 
         cur.execute("""
@@ -54,81 +183,117 @@ def init_db():
             plan TEXT NOT NULL DEFAULT 'paid',
             device_id TEXT,
             created_at TEXT NOT NULL,
-            bound_at TEXT
+            bound_at TEXT,
+            email_status TEXT
         )
         """)
 
+        # 'pending' until the key email is confirmed sent, so a send lost to a restart
+        # can be found and redone; NULL for licenses issued before this was tracked
+        cols = {row[1] for row in cur.execute("PRAGMA table_info(licenses)")}
+        if "email_status" not in cols:
+            cur.execute("ALTER TABLE licenses ADD COLUMN email_status TEXT")
+
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_licenses_device_paid
+        ON licenses(device_id) WHERE plan='paid'
+        """)
+
 def get_email_for_device(device_id: str) -> str | None:
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT email FROM device_email WHERE device_id=?", (device_id,))
+        cur.execute(SQL_GET_EMAIL, (device_id,))
         row = cur.fetchone()
         return row[0] if row else None
 
 def set_email_for_device(device_id: str, email: str):
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     email = (email or "").strip().lower()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO device_email(device_id, email, verified, updated_at)
-            VALUES(?,?,1,?)
-            ON CONFLICT(device_id) DO UPDATE SET
-              email=excluded.email,
-              verified=1,
-              updated_at=excluded.updated_at
-        """, (device_id, email, now))
+        cur.execute(SQL_SET_EMAIL, (device_id, email, now))
 
 def get_total_count(device_id: str) -> int:
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT total_count FROM usage_total WHERE device_id=?", (device_id,))
+        cur.execute(SQL_GET_TOTAL, (device_id,))
         row = cur.fetchone()
         return int(row[0]) if row else 0
 
 def inc_total_count(device_id: str, amount: int = 1):
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO usage_total(device_id, total_count, created_at)
-            VALUES(?,?,?)
-            ON CONFLICT(device_id) DO UPDATE SET total_count = total_count + ?
-        """, (device_id, amount, now, amount))
+        conn.execute(SQL_INC_TOTAL, (device_id, amount, now))
+
+def inc_and_get_total_count(device_id: str, amount: int = 1) -> int:
+    """Increments and returns the new total in one statement."""
+    now = _now_iso()
+    with get_conn() as conn:
+        row = conn.execute(SQL_INC_GET_TOTAL, (device_id, amount, now)).fetchone()
+    return int(row[0])
+
+def consume_total_count(device_id: str, cap: int, amount: int = 1) -> tuple[bool, int]:
+    """Atomically adds amount if the total stays <= cap; returns (allowed, remaining)."""
+    if amount > cap:
+        return False, 0
+    now = _now_iso()
+    with get_conn() as conn:
+        row = conn.execute(SQL_CONSUME_TOTAL, (device_id, amount, now, cap)).fetchone()
+    if row is None:
+        return False, 0
+    return True, cap - int(row[0])
 
 def get_daily_count(device_id: str, day: str | None = None) -> int:
-    day = day or _utc_date_str()
+    day = day or utc_date_str()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT count FROM usage_daily WHERE device_id=? AND day=?", (device_id, day))
+        cur.execute(SQL_GET_DAILY, (device_id, day))
         row = cur.fetchone()
         return int(row[0]) if row else 0
 
 def inc_daily_count(device_id: str, amount: int = 1, day: str | None = None):
-    day = day or _utc_date_str()
+    day = day or utc_date_str()
     with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO usage_daily(device_id, day, count)
-            VALUES(?,?,?)
-            ON CONFLICT(device_id, day) DO UPDATE SET count = count + ?
-        """, (device_id, day, amount, amount))
+        conn.execute(SQL_INC_DAILY, (device_id, day, amount))
+
+def inc_and_get_daily_count(device_id: str, amount: int = 1, day: str | None = None) -> int:
+    """Increments and returns the new daily count in one statement."""
+    day = day or utc_date_str()
+    with get_conn() as conn:
+        row = conn.execute(SQL_INC_GET_DAILY, (device_id, day, amount)).fetchone()
+    return int(row[0])
+
+def consume_daily_count(device_id: str, cap: int, amount: int = 1, day: str | None = None) -> tuple[bool, int]:
+    """Atomically adds amount if the day's count stays <= cap; returns (allowed, remaining)."""
+    if amount > cap:
+        return False, 0
+    day = day or utc_date_str()
+    with get_conn() as conn:
+        row = conn.execute(SQL_CONSUME_DAILY, (device_id, day, amount, cap)).fetchone()
+    if row is None:
+        return False, 0
+    return True, cap - int(row[0])
 
 def create_license(license_key: str, email: str, plan: str = "paid"):
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     email = (email or "").strip().lower()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO licenses(license_key, email, plan, device_id, created_at, bound_at)
-            VALUES(?,?,?,?,?,NULL)""", (license_key, email, plan, None, now))
+        cur.execute(SQL_CREATE_LICENSE, (license_key, email, plan, None, now))
+
+def set_license_email_status(license_key: str, status: str):
+    with get_conn() as conn:
+        conn.execute(SQL_SET_LICENSE_EMAIL_STATUS, (status, license_key))
 
 def bind_license_to_device(license_key: str, device_id: str) -> tuple[bool, str]:
-    now = datetime.now(timezone.utc).isoformat()
+    now = _now_iso()
     license_key = (license_key or "").strip().upper()
     with get_conn() as conn:
+        # take the write lock before the SELECT so the read-then-UPDATE cannot race
+        # another binder; waiters sleep inside SQLite via busy_timeout
+        conn.execute("BEGIN IMMEDIATE")
         cur = conn.cursor()
-        cur.execute("SELECT device_id FROM licenses WHERE license_key=?", (license_key,))
+        cur.execute(SQL_GET_LICENSE_DEVICE, (license_key,))
         row = cur.fetchone()
         if not row:
             return False, "LICENSE_NOT_FOUND"
@@ -137,11 +302,11 @@ def bind_license_to_device(license_key: str, device_id: str) -> tuple[bool, str]
             return False, "LICENSE_ALREADY_BOUND_TO_ANOTHER_DEVICE"
         if bound_device == device_id:
             return True, "ALREADY_BOUND"
-        cur.execute("UPDATE licenses SET device_id=?, bound_at=? WHERE license_key=?", (device_id, now, license_key))
+        cur.execute(SQL_BIND_LICENSE, (device_id, now, license_key))
         return True, "BOUND_OK"
 
 def is_device_paid(device_id: str) -> bool:
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT 1 FROM licenses WHERE device_id=? AND plan='paid' LIMIT 1", (device_id,))
+        cur.execute(SQL_IS_PAID, (device_id,))
         return cur.fetchone() is not None
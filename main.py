@@ -1,24 +1,173 @@
-import json
+import asyncio
+import os
 from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File, Form
+import orjson
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from services.openai_vision import vision_quick_sniff
+import db
+from services.emailer import drain_background_sends
+from services.http import close_http, get_http
+from services.openai_vision import (
+    prepare_image_async,
+    shutdown_image_pools,
+    vision_quick_sniff,
+    vision_quick_sniff_stream,
+)
+from services.redis_store import close_redis
+
+MAX_IMAGES = 8
+UPLOAD_CHUNK = 1 << 16
+# Whole request body (all parts) and per-image caps, checked before/while reading
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50_000_000)))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(15_000_000)))
+
+# Built once; fallbacks only swap in "Item" and the summary
+_FALLBACK_FIELDS = {
+    "Item": "",
+    "Condition": "unknown",
+    "Resale Price Range": "$0 - $0",
+    "Confidence": "low",
+    "Risk Level": "low",
+    "Verdict": "SKIP",
+}
+
+
+def _parse_model_json(raw: str) -> dict:
+    # output is schema-constrained (strict json_schema), so one parse is enough;
+    # orjson.JSONDecodeError is a ValueError, which callers turn into the fallback
+    data = orjson.loads(raw)
+    if not isinstance(data, dict):
+        raise ValueError("model output is not a JSON object")
+    return data
+
+
+async def _read_upload(f: UploadFile) -> memoryview:
+    # drain the spooled upload in fixed chunks; hand back a view so later stages never copy it
+    size = f.size
+    if size is not None and size > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="TOO_LARGE")
+    buf = bytearray()
+    while chunk := await f.read(UPLOAD_CHUNK):
+        buf += chunk
+        if len(buf) > MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail="TOO_LARGE")
+    return memoryview(buf)
+
+
+_EXT2MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+}
+
+
+def _mime_from_filename(filename: Optional[str]) -> str:
+    # only the extension matters, so look after the last "." instead of splitext on the path
+    if filename:
+        i = filename.rfind(".")
+        if i >= 0:
+            return _EXT2MIME.get(filename[i:].lower(), "image/jpeg")
+    return "image/jpeg"
+
+
+def _upload_mime(f: UploadFile) -> str:
+    # some clients send no type or a generic one for camera uploads
+    ct = f.content_type
+    if ct and ct.startswith("image/"):
+        return ct
+    return _mime_from_filename(f.filename)
+
+
+async def _ingest_upload(f: UploadFile) -> dict:
+    # hash/encode each image as soon as its own read finishes, overlapping the other reads
+    data = await _read_upload(f)
+    return await prepare_image_async(data, _upload_mime(f))
+
+
+def _fallback_ui(item: str, summary: str) -> dict:
+    return {"ui": {"fields": {**_FALLBACK_FIELDS, "Item": item}, "summary": summary}}
+
+
+def _ui_from_raw(raw: str) -> dict:
+    # Try parse JSON; if model returns text, fallback safely
+    try:
+        return _parse_model_json(raw)
+    except ValueError:
+        return _fallback_ui("Could not parse model output", raw[:500])
+
+
+def _error_ui(e: Exception) -> dict:
+    return _fallback_ui("Temporary fallback", "OpenAI call failed.\n%s: %s" % (type(e).__name__, e))
+
+
+def _ndjson(data: dict) -> bytes:
+    return orjson.dumps(data) + b"\n"
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
-app = FastAPI()
 
+class LimitSizeMiddleware:
+    """Rejects oversized bodies from the Content-Length header alone, before multipart parsing spools them.
+
+    Plain ASGI, so streamed responses pass straight through; chunked uploads without a
+    Content-Length are left to the per-file cap in _read_upload.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > MAX_UPLOAD_BYTES:
+                        response = ORJSONResponse(status_code=413, content={"detail": "TOO_LARGE"})
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+
+# added before CORS so CORS stays the outermost layer and a 413 still carries its headers
+app.add_middleware(LimitSizeMiddleware)
+
+# Explicit methods/headers instead of "*" so preflights are not echoed per request;
+# max_age lets browsers cache the preflight for a day.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type", "x-device-id"],
+    max_age=86400,
 )
 
+
+@app.on_event("startup")
+async def startup():
+    db.init_db()
+    db.optimize()
+    get_http()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # queued sends (license keys) still need the HTTP client and the db, so they go first
+    await drain_background_sends()
+    db.close_pool()
+    await close_redis()
+    await close_http()
+    shutdown_image_pools()
+
+
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True, "service": "treasure-sniffer-backend"}
 
 
@@ -42,12 +191,10 @@ async def describe(
     language: str = Form("en"),
 ):
     try:
-        openai_images = []
-        for f in images:
-            b = await f.read()
-            openai_images.append({"data": b, "content_type": f.content_type or "image/jpeg"})
+        uploads = images[:MAX_IMAGES]
+        openai_images = await asyncio.gather(*(_ingest_upload(f) for f in uploads))
 
-        raw = vision_quick_sniff(
+        raw = await vision_quick_sniff(
             images=openai_images,
             hint=hint,
             asking_price=asking_price,
@@ -55,41 +202,50 @@ async def describe(
             language=language,
         )
 
-        # Try parse JSON; if model returns text, fallback safely
-        try:
-            data = json.loads(raw)
-        except Exception:
-            data = {
-                "ui": {
-                    "fields": {
-                        "Item": "Could not parse model output",
-                        "Condition": "unknown",
-                        "Resale Price Range": "$0 - $0",
-                        "Confidence": "low",
-                        "Risk Level": "low",
-                        "Verdict": "SKIP",
-                    },
-                    "summary": raw[:500],
-                }
-            }
-
-        return JSONResponse(content=data)
+        return ORJSONResponse(content=_ui_from_raw(raw))
 
+    except HTTPException:
+        raise
     except Exception as e:
         # safe-mode response so frontend never crashes
-        return JSONResponse(
-            status_code=200,
-            content={
-                "ui": {
-                    "fields": {
-                        "Item": "Temporary fallback",
-                        "Condition": "unknown",
-                        "Resale Price Range": "$0 - $0",
-                        "Confidence": "low",
-                        "Risk Level": "low",
-                        "Verdict": "SKIP",
-                    },
-                    "summary": f"OpenAI call failed.\n{type(e).__name__}: {str(e)}",
-                }
-            },
-        )
+        return ORJSONResponse(status_code=200, content=_error_ui(e))
+
+
+@app.post("/api/describe-stream")
+async def describe_stream(
+    images: List[UploadFile] = File(...),
+    hint: Optional[str] = Form(None),
+    asking_price: Optional[float] = Form(None),
+    currency: str = Form("USD"),
+    language: str = Form("en"),
+):
+    # NDJSON: {"delta": "..."} lines as the model writes, then one final line
+    # with the same {"ui": ...} object /api/describe returns
+    try:
+        uploads = images[:MAX_IMAGES]
+        openai_images = await asyncio.gather(*(_ingest_upload(f) for f in uploads))
+    except HTTPException:
+        raise
+    except Exception as e:
+        # same safe-mode answer as /api/describe, as a one-line stream
+        return StreamingResponse(iter((_ndjson(_error_ui(e)),)), media_type="application/x-ndjson")
+
+    async def gen():
+        parts = []
+        try:
+            async for delta in vision_quick_sniff_stream(
+                images=openai_images,
+                hint=hint,
+                asking_price=asking_price,
+                currency=currency,
+                language=language,
+            ):
+                parts.append(delta)
+                yield _ndjson({"delta": delta})
+            data = _ui_from_raw("".join(parts))
+        except Exception as e:
+            # safe-mode final line so frontend never crashes
+            data = _error_ui(e)
+        yield _ndjson(data)
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import os
 import base64
 import urllib.parse
 from time import time
 from typing import List, Dict, Any, Optional
 
-import requests
+import orjson
+from redis.exceptions import RedisError
+
+from services.http import get_http
+from services.redis_store import get_async_redis
 
 EBAY_CLIENT_ID = (os.getenv("EBAY_CLIENT_ID") or "").strip()
 EBAY_CLIENT_SECRET = (os.getenv("EBAY_CLIENT_SECRET") or "").strip()
@@ -16,15 +21,18 @@ EBAY_MARKETPLACE_ID = (os.getenv("EBAY_MARKETPLACE_ID") or "EBAY_DE").strip()
 EBAY_TOKEN_URL = "https://api.ebay.com/identity/v1/oauth2/token"
 EBAY_BROWSE_SEARCH_URL = "https://api.ebay.com/buy/browse/v1/item_summary/search"
 
+BATCH_MAX_CONCURRENCY = 10
+
 _token_cache: Optional[str] = None
 _token_expire_at: float = 0.0
+_TOKEN_LOCK = asyncio.Lock()
 
-def _get_token() -> str:
-    global _token_cache, _token_expire_at
-
-    if _token_cache and time() < _token_expire_at:
-        return _token_cache
+# Shared across workers when REDIS_URL is set; the lock key keeps a single minter
+REDIS_TOKEN_KEY = "ebay:token"
+REDIS_TOKEN_LOCK_KEY = "ebay:token:lock"
+REDIS_TOKEN_WAIT = 10.0
 
+async def _mint_token() -> tuple[str, int]:
     if not EBAY_CLIENT_ID or not EBAY_CLIENT_SECRET:
         raise RuntimeError("EBAY_CLIENT_ID / EBAY_CLIENT_SECRET missing")
 
@@ -34,22 +42,79 @@ def _get_token() -> str:
     headers = {"Authorization": f"Basic {b64}", "Content-Type": "application/x-www-form-urlencoded"}
     data = {"grant_type": "client_credentials", "scope": "https://api.ebay.com/oauth/api_scope"}
 
-    r = requests.post(EBAY_TOKEN_URL, headers=headers, data=data, timeout=30)
+    r = await get_http().post(EBAY_TOKEN_URL, headers=headers, data=data)
     if r.status_code != 200:
         raise RuntimeError(f"eBay token error {r.status_code}: {r.text}")
 
-    payload = r.json()
+    payload = orjson.loads(r.content)
     token = payload.get("access_token")
     expires_in = int(payload.get("expires_in", 7200))
     if not token:
         raise RuntimeError("eBay token missing access_token")
+    return token, max(60, expires_in - 60)
+
+async def _shared_token(r) -> tuple[Optional[str], int]:
+    token = await r.get(REDIS_TOKEN_KEY)
+    if not token:
+        return None, 0
+    return token, max(0, int(await r.ttl(REDIS_TOKEN_KEY)))
+
+async def _mint_token_shared(r) -> tuple[str, int]:
+    deadline = time() + REDIS_TOKEN_WAIT
+    while not await r.set(REDIS_TOKEN_LOCK_KEY, "1", nx=True, ex=int(REDIS_TOKEN_WAIT)):
+        # another worker is minting; wait for it to publish
+        token, ttl = await _shared_token(r)
+        if token and ttl > 0:
+            return token, ttl
+        if time() >= deadline:
+            return await _mint_token()
+        await asyncio.sleep(0.2)
+    try:
+        token, ttl = await _shared_token(r)
+        if token and ttl > 0:
+            return token, ttl
+        token, ttl = await _mint_token()
+        try:
+            await r.set(REDIS_TOKEN_KEY, token, ex=ttl)
+        except RedisError:
+            pass  # the token is good either way; other workers just mint their own
+        return token, ttl
+    finally:
+        try:
+            await r.delete(REDIS_TOKEN_LOCK_KEY)
+        except RedisError:
+            pass  # the lock expires on its own after REDIS_TOKEN_WAIT
+
+async def _get_token() -> str:
+    global _token_cache, _token_expire_at
 
-    _token_cache = token
-    _token_expire_at = time() + max(60, expires_in - 60)
-    return token
+    if _token_cache and time() < _token_expire_at:
+        return _token_cache
 
-def ebay_search_comps(query: str, want: int = 5, limit: int = 12) -> List[Dict[str, Any]]:
-    token = _get_token()
+    async with _TOKEN_LOCK:
+        # re-check: another coroutine may have refreshed while we waited
+        if _token_cache and time() < _token_expire_at:
+            return _token_cache
+
+        r = get_async_redis()
+        token, ttl = None, 0
+        if r is not None:
+            try:
+                token, ttl = await _shared_token(r)
+                if not token or ttl <= 0:
+                    token, ttl = await _mint_token_shared(r)
+            except RedisError:
+                # Redis only shares the token; an outage falls back to minting it here
+                token, ttl = None, 0
+        if not token or ttl <= 0:
+            token, ttl = await _mint_token()
+
+        _token_cache = token
+        _token_expire_at = time() + ttl
+        return token
+
+async def ebay_search_comps(query: str, want: int = 5, limit: int = 12) -> List[Dict[str, Any]]:
+    token = await _get_token()
 
     params = {
         "q": query,
@@ -64,11 +129,11 @@ def ebay_search_comps(query: str, want: int = 5, limit: int = 12) -> List[Dict[s
         "Accept": "application/json",
     }
 
-    r = requests.get(url, headers=headers, timeout=30)
+    r = await get_http().get(url, headers=headers)
     if r.status_code != 200:
         raise RuntimeError(f"eBay search error {r.status_code}: {r.text}")
 
-    data = r.json() or {}
+    data = orjson.loads(r.content) or {}
     items = data.get("itemSummaries", []) or []
 
     out = []
@@ -85,3 +150,16 @@ def ebay_search_comps(query: str, want: int = 5, limit: int = 12) -> List[Dict[s
         })
 
     return [x for x in out if x["url"]]
+
+async def ebay_search_comps_batch(queries: List[str], want: int = 5, limit: int = 12) -> List[List[Dict[str, Any]]]:
+    """Runs ebay_search_comps for each query concurrently; results keep query order."""
+    if not queries:
+        return []
+    await _get_token()  # mint once up front so the searches don't all wait on the lock
+    sem = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    async def one(q: str) -> List[Dict[str, Any]]:
+        async with sem:
+            return await ebay_search_comps(q, want=want, limit=limit)
+
+    return list(await asyncio.gather(*(one(q) for q in queries)))
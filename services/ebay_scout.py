@@ -1,10 +1,46 @@
 from __future__ import annotations
 
+import asyncio
+import os
 import re
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-from playwright.async_api import async_playwright, TimeoutError as PWTimeout
+from selectolax.lexbor import LexborHTMLParser
 
+from services.http import get_http
+
+if TYPE_CHECKING:
+    from playwright.async_api import BrowserContext, Route
+
+
+SRP_URL = "https://www.ebay.com/sch/i.html"
+SRP_RESULTS_SELECTOR = "ul.srp-results, div.srp-river-results"
+# the SRP is server-rendered, but eBay serves a bot wall to the default httpx agent
+SRP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+# On-disk Chromium profile for the fallback, so its HTTP cache and TLS sessions survive
+# between scouts; empty keeps the old throwaway context. Suffixed with the pid because a
+# profile dir can only be open in one browser at a time.
+SCOUT_PROFILE_DIR = (os.getenv("EBAY_SCOUT_PROFILE_DIR") or "").strip()
+_profile_lock = asyncio.Lock()
+
+# 3 queries x (active, sold) all fit at once; more than this starts to trip eBay's
+# rate limiting
+_search_slots = asyncio.Semaphore(6)
+
+# only title/price/link text is scraped, so none of these are worth downloading
+_BLOCKED_RESOURCES = frozenset({"image", "font", "media", "stylesheet"})
+
+# eBay's placeholder first row; the length guard skips lowercasing real (long) titles
+_SENTINEL_TITLES = frozenset({"shop on ebay"})
+_SENTINEL_MAX_LEN = max(map(len, _SENTINEL_TITLES))
 
 PRICE_RE = re.compile(r"([0-9]+(?:[\.,][0-9]+)?)")
 
@@ -12,14 +48,19 @@ PRICE_RE = re.compile(r"([0-9]+(?:[\.,][0-9]+)?)")
 def _parse_price_to_usd(raw: str) -> Optional[float]:
     if not raw:
         return None
-    s = raw.replace(",", "").strip()
-    m = PRICE_RE.search(s)
-    if not m:
-        return None
-    try:
-        return float(m.group(1))
-    except Exception:
-        return None
+    # eBay prices are almost always "$12.34" or "$12.34 to $20.00": one float() on the
+    # first token is ~2x quicker than the replace + regex below, which stays for the rest
+    if raw[0] == "$":
+        tok = raw[1:].partition(" ")[0]
+        if tok[:1].isdigit():
+            try:
+                return float(tok.replace(",", "") if "," in tok else tok)
+            except ValueError:
+                pass
+    # search() doesn't care about surrounding whitespace, and with the commas gone the
+    # match is always plain digits[.digits], which float() can't reject
+    m = PRICE_RE.search(raw.replace(",", "") if "," in raw else raw)
+    return float(m.group(1)) if m else None
 
 
 def _min_max(prices: List[float]) -> Optional[Tuple[float, float]]:
@@ -28,103 +69,225 @@ def _min_max(prices: List[float]) -> Optional[Tuple[float, float]]:
     return (round(min(prices), 2), round(max(prices), 2))
 
 
-async def _search_ebay(query: str, sold: bool, limit: int = 8, timeout_ms: int = 25000) -> Dict[str, Any]:
-    base = "https://www.ebay.com/sch/i.html"
+def _search_url(query: str, sold: bool) -> str:
     q = query.strip().replace(" ", "+")
-    url = f"{base}?_nkw={q}"
+    url = f"{SRP_URL}?_nkw={q}"
     if sold:
         url += "&LH_Sold=1&LH_Complete=1"
+    return url
+
+
+def _example(title: str, href: Optional[str], raw_price: str, sold_date: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not title or not href or (len(title) <= _SENTINEL_MAX_LEN and title.lower() in _SENTINEL_TITLES):
+        return None
+    ex = {"title": title, "url": href, "raw_price": raw_price, "price_usd": _parse_price_to_usd(raw_price)}
+    if sold_date:
+        ex["sold_date"] = sold_date
+    return ex
+
+
+def _result(query: str, sold: bool, count_text: Optional[str], examples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prices = [float(ex["price_usd"]) for ex in examples if isinstance(ex["price_usd"], (int, float))]
+    mm = _min_max(prices)
+    return {
+        "query": query,
+        "mode": "sold" if sold else "active",
+        "count_text": count_text,
+        "price_range_usd": list(mm) if mm else None,
+        "examples": examples,
+    }
+
+
+def _empty_result(query: str, sold: bool) -> Dict[str, Any]:
+    return _result(query, sold, None, [])
+
+
+def _text(node) -> str:
+    # whitespace-normalised like innerText, so nested price spans keep their spacing
+    return " ".join(node.text().split()) if node is not None else ""
+
+
+async def _search_ebay(query: str, sold: bool, limit: int = 8, timeout_ms: int = 25000) -> Optional[Dict[str, Any]]:
+    """One GET + HTML parse; None means eBay didn't hand us a results page."""
+    async with _search_slots:
+        r = await get_http().get(_search_url(query, sold), headers=SRP_HEADERS, timeout=timeout_ms / 1000)
+    if r.status_code != 200:
+        return None
+
+    tree = LexborHTMLParser(r.text)
+    heading = tree.css_first("h1.srp-controls__count-heading")
+    # a bot wall or error page has neither the count heading nor the results list; a real
+    # page with zero listings has them and is a valid (empty) answer, not a browser retry
+    if heading is None and tree.css_first(SRP_RESULTS_SELECTOR) is None:
+        return None
+
+    count_text = _text(heading.css_first("span.BOLD") or heading) if heading is not None else ""
+    count_text = count_text or None
+    items = tree.css("li.s-item")
+
+    examples: List[Dict[str, Any]] = []
+    for it in items:
+        if len(examples) >= limit:
+            break
+        title_el = it.css_first("div.s-item__title span[role='heading']")
+        if title_el is None:
+            continue
+        link_el = it.css_first("a.s-item__link")
+        ex = _example(
+            _text(title_el),
+            link_el.attributes.get("href") if link_el is not None else None,
+            _text(it.css_first("span.s-item__price")),
+            _text(it.css_first("span.s-item__ended-date")) if sold else None,
+        )
+        if ex:
+            examples.append(ex)
+    return _result(query, sold, count_text, examples)
+
+
+# count heading and rows in one call, in the same shape the selectolax path reads them in
+_SRP_JS = """() => {
+    const heading = document.querySelector('h1.srp-controls__count-heading');
+    const rows = Array.from(document.querySelectorAll('li.s-item'), (li) => {
+        const text = (sel) => li.querySelector(sel)?.innerText?.trim() ?? null;
+        return {
+            title: text("div.s-item__title span[role='heading']"),
+            href: li.querySelector('a.s-item__link')?.getAttribute('href') ?? null,
+            raw_price: text('span.s-item__price'),
+            sold_date: text('span.s-item__ended-date'),
+        };
+    });
+    return {count: heading ? (heading.querySelector('span.BOLD') || heading).innerText.trim() : null, rows};
+}"""
+
+
+async def _block_heavy(route: Route) -> None:
+    if route.request.resource_type in _BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _search_ebay_browser(
+    context: BrowserContext, query: str, sold: bool, limit: int = 8, timeout_ms: int = 25000
+) -> Dict[str, Any]:
+    from playwright.async_api import TimeoutError as PWTimeout
 
     examples: List[Dict[str, Any]] = []
-    prices: List[float] = []
     count_text: Optional[str] = None
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(locale="en-US")
+    # the browser and context belong to _browser_searches; each search only opens its own page
+    async with _search_slots:
         page = await context.new_page()
-
         try:
-            await page.goto(url, wait_until="domcontentloaded", timeout=timeout_ms)
-
-            try:
-                el = await page.query_selector("h1.srp-controls__count-heading span.BOLD")
-                if el:
-                    count_text = (await el.inner_text()).strip()
-                else:
-                    el2 = await page.query_selector("h1.srp-controls__count-heading")
-                    if el2:
-                        count_text = (await el2.inner_text()).strip()
-            except Exception:
-                pass
+            await page.goto(_search_url(query, sold), wait_until="domcontentloaded", timeout=timeout_ms)
 
-            items = await page.query_selector_all("li.s-item")
-            for it in items:
+            # one round trip to the browser for the heading and every row instead of
+            # two for the heading plus ~4 per item
+            srp = await page.evaluate(_SRP_JS)
+            count_text = srp["count"] or None
+            for row in srp["rows"]:
                 if len(examples) >= limit:
                     break
-
-                title_el = await it.query_selector("div.s-item__title span[role='heading']")
-                if not title_el:
-                    continue
-                title = (await title_el.inner_text()).strip()
-                if not title or title.lower() in {"shop on ebay"}:
+                if row["title"] is None:
                     continue
+                ex = _example(row["title"], row["href"], row["raw_price"] or "", row["sold_date"] if sold else None)
+                if ex:
+                    examples.append(ex)
 
-                link_el = await it.query_selector("a.s-item__link")
-                href = await link_el.get_attribute("href") if link_el else None
-                if not href:
-                    continue
+        except PWTimeout:
+            pass
+        finally:
+            await page.close()
 
-                price_el = await it.query_selector("span.s-item__price")
-                raw_price = (await price_el.inner_text()).strip() if price_el else ""
-                price = _parse_price_to_usd(raw_price)
+    return _result(query, sold, count_text, examples)
 
-                sold_date = None
-                if sold:
-                    sd = await it.query_selector("span.s-item__ended-date")
-                    if sd:
-                        sold_date = (await sd.inner_text()).strip()
 
-                ex = {"title": title, "url": href, "raw_price": raw_price, "price_usd": price}
-                if sold_date:
-                    ex["sold_date"] = sold_date
+async def _run_searches(context: BrowserContext, jobs: List[Tuple[str, bool]], limit: int) -> List[Any]:
+    await context.route("**/*", _block_heavy)
+    return await asyncio.gather(
+        *(_search_ebay_browser(context, q, sold=mode, limit=limit) for q, mode in jobs),
+        return_exceptions=True,
+    )
 
-                examples.append(ex)
-                if isinstance(price, (int, float)):
-                    prices.append(float(price))
 
-        except PWTimeout:
-            pass
+async def _browser_searches(jobs: List[Tuple[str, bool]], limit: int) -> List[Any]:
+    """Chromium fallback for the searches the plain GET couldn't serve."""
+    try:
+        from playwright.async_api import async_playwright
+    except ImportError:
+        return [_empty_result(q, mode) for q, mode in jobs]
+
+    # one Chromium launch and one context for all of them; launching per search
+    # dominated the wall time
+    async with async_playwright() as pw:
+        if SCOUT_PROFILE_DIR:
+            async with _profile_lock:
+                context = await pw.chromium.launch_persistent_context(
+                    f"{SCOUT_PROFILE_DIR}-{os.getpid()}", headless=True, locale="en-US"
+                )
+                try:
+                    return await _run_searches(context, jobs, limit)
+                finally:
+                    await context.close()
+
+        browser = await pw.chromium.launch(headless=True)
+        context = await browser.new_context(locale="en-US")
+        try:
+            return await _run_searches(context, jobs, limit)
         finally:
             await context.close()
             await browser.close()
 
-    mm = _min_max(prices)
-    return {
-        "query": query,
-        "mode": "sold" if sold else "active",
-        "count_text": count_text,
-        "price_range_usd": list(mm) if mm else None,
-        "examples": examples,
-    }
-
 
 async def ebay_scout(queries: List[str], limit_each: int = 6) -> Dict[str, Any]:
-    queries = [q.strip() for q in queries if q and q.strip()][:3]
+    # collapse whitespace and drop case-insensitive repeats in one pass, so a duplicate
+    # never costs two more page loads
+    seen = set()
+    unique: List[str] = []
+    for q in queries:
+        qn = " ".join(q.split()) if q else ""
+        k = qn.lower()
+        if qn and k not in seen:
+            seen.add(k)
+            unique.append(qn)
+            if len(unique) == 3:
+                break
+    queries = unique
 
     active: List[Dict[str, Any]] = []
     sold: List[Dict[str, Any]] = []
     sold_prices: List[float] = []
 
-    for q in queries:
-        a = await _search_ebay(q, sold=False, limit=limit_each)
-        s = await _search_ebay(q, sold=True, limit=limit_each)
-        active.append(a)
-        sold.append(s)
-        for ex in s.get("examples", []):
-            p = ex.get("price_usd")
-            if isinstance(p, (int, float)):
-                sold_prices.append(float(p))
+    jobs = [(q, mode) for q in queries for mode in (False, True)]
+    # every (query, mode) search is independent, so they run side by side; results come
+    # back in job order: active, sold, active, ...
+    results: List[Any] = list(
+        await asyncio.gather(
+            *(_search_ebay(q, sold=mode, limit=limit_each) for q, mode in jobs),
+            return_exceptions=True,
+        )
+    )
+
+    retry = [i for i, res in enumerate(results) if res is None or isinstance(res, BaseException)]
+    if retry:
+        try:
+            fallback = await _browser_searches([jobs[i] for i in retry], limit_each)
+        except Exception:
+            fallback = []
+        for i, res in zip(retry, fallback):
+            results[i] = res
+
+    for i, res in enumerate(results):
+        mode = i % 2 == 1
+        if res is None or isinstance(res, BaseException):
+            # one failed search shouldn't sink the other five
+            res = _empty_result(queries[i // 2], mode)
+        (sold if mode else active).append(res)
+        if mode:
+            for ex in res.get("examples", []):
+                p = ex.get("price_usd")
+                if isinstance(p, (int, float)):
+                    sold_prices.append(float(p))
 
     overall = _min_max(sold_prices)
     return {
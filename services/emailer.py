@@ -1,10 +1,30 @@
+import asyncio
 import os
-import requests
+from typing import Awaitable
+
+import orjson
+
+from services.http import get_http
 
 RESEND_API_KEY = os.getenv("RESEND_API_KEY", "").strip()
 FROM_EMAIL = os.getenv("FROM_EMAIL", "Flea Assistant <no-reply@example.com>").strip()
+# How long shutdown waits for queued sends before the worker exits
+EMAIL_DRAIN_TIMEOUT = float(os.getenv("EMAIL_DRAIN_TIMEOUT", "20"))
+
+# hold references so in-flight sends aren't garbage-collected mid-request
+_background: set[asyncio.Task] = set()
+
+def send_in_background(send: Awaitable) -> None:
+    """Runs a send after the response has gone out; drain_background_sends() waits for it."""
+    task = asyncio.ensure_future(send)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+async def drain_background_sends(timeout: float = EMAIL_DRAIN_TIMEOUT):
+    if _background:
+        await asyncio.wait(list(_background), timeout=timeout)
 
-def send_email(to_email: str, subject: str, text: str) -> tuple[bool, str]:
+async def send_email(to_email: str, subject: str, text: str) -> tuple[bool, str]:
     to_email = (to_email or "").strip()
     if not to_email:
         return False, "EMPTY_EMAIL"
@@ -18,10 +38,10 @@ def send_email(to_email: str, subject: str, text: str) -> tuple[bool, str]:
         return True, "LOG_ONLY"
 
     try:
-        r = requests.post(
+        r = await get_http().post(
             "https://api.resend.com/emails",
             headers={"Authorization": f"Bearer {RESEND_API_KEY}", "Content-Type": "application/json"},
-            json={"from": FROM_EMAIL, "to": [to_email], "subject": subject, "text": text},
+            content=orjson.dumps({"from": FROM_EMAIL, "to": [to_email], "subject": subject, "text": text}),
             timeout=15,
         )
         if 200 <= r.status_code < 300:
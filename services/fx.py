@@ -1,15 +1,70 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import statistics
-from typing import Dict, Any, List, Optional, Tuple
+from time import time
+from typing import Dict, Any, List, Optional, Set, Tuple
 
-import requests
+import orjson
+
+from services.http import get_http
+from services.redis_store import get_async_redis
 
 FX_URL = "https://api.frankfurter.dev/latest"
-_FX_CACHE: Dict[Tuple[str, str], float] = {}
+FX_TTL_SECONDS = 6 * 3600
+
+# (frm, to) -> (rate, expires_at); Redis (fx:{frm}:{to}) backs it across workers and restarts
+_FX_CACHE: Dict[Tuple[str, str], Tuple[float, float]] = {}
+
+def _redis_key(frm: str, to: str) -> str:
+    return f"fx:{frm}:{to}"
 
-def fx_rate(frm: str, to: str = "USD") -> Optional[float]:
+def _local_rate(frm: str, to: str) -> Optional[float]:
+    entry = _FX_CACHE.get((frm, to))
+    if entry and entry[1] > time():
+        return entry[0]
+    return None
+
+async def _shared_rates(pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+    r = get_async_redis()
+    if r is None or not pairs:
+        return {}
+    try:
+        # GET + PTTL per key in one round trip, so the local copy expires with the shared one
+        async with r.pipeline(transaction=False) as pipe:
+            for frm, to in pairs:
+                pipe.get(_redis_key(frm, to))
+                pipe.pttl(_redis_key(frm, to))
+            replies = await pipe.execute()
+    except Exception:
+        return {}
+    found = {}
+    now = time()
+    for pair, value, pttl in zip(pairs, replies[0::2], replies[1::2]):
+        if value is not None:
+            found[pair] = float(value)
+            # pttl is -1 for a key without expiry; never keep a rate past FX_TTL_SECONDS
+            remaining = pttl / 1000 if pttl > 0 else FX_TTL_SECONDS
+            _FX_CACHE[pair] = (found[pair], now + min(remaining, FX_TTL_SECONDS))
+    return found
+
+async def _store_rates(rates: Dict[Tuple[str, str], float]):
+    expires_at = time() + FX_TTL_SECONDS
+    for pair, rate in rates.items():
+        _FX_CACHE[pair] = (rate, expires_at)
+    r = get_async_redis()
+    if r is None or not rates:
+        return
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for (frm, to), rate in rates.items():
+                pipe.set(_redis_key(frm, to), rate, ex=FX_TTL_SECONDS)
+            await pipe.execute()
+    except Exception:
+        pass
+
+async def fx_rate(frm: str, to: str = "USD") -> Optional[float]:
     frm = (frm or "").upper().strip()
     to = (to or "").upper().strip()
     if not frm or not to:
@@ -18,32 +73,80 @@ def fx_rate(frm: str, to: str = "USD") -> Optional[float]:
         return 1.0
 
     key = (frm, to)
-    if key in _FX_CACHE:
-        return _FX_CACHE[key]
+    rate = _local_rate(frm, to)
+    if rate is not None:
+        return rate
+    shared = await _shared_rates([key])
+    if key in shared:
+        return shared[key]
 
     try:
-        r = requests.get(FX_URL, params={"from": frm, "to": to}, timeout=15)
+        r = await get_http().get(FX_URL, params={"from": frm, "to": to}, timeout=15)
         if r.status_code != 200:
             return None
-        data = r.json()
+        data = orjson.loads(r.content)
         rate = float(data["rates"][to])
-        _FX_CACHE[key] = rate
-        return rate
     except Exception:
         return None
+    await _store_rates({key: rate})
+    return rate
+
+async def fx_rates_for(currencies: Set[str], to: str = "USD") -> Dict[str, float]:
+    """Rates into `to` for every currency, fetched with one multi-symbol request where possible."""
+    to = (to or "").upper().strip()
+    rates: Dict[str, float] = {}
+    missing = []
+    for cur in currencies:
+        if not cur:
+            continue
+        if cur == to:
+            rates[cur] = 1.0
+        elif (cached := _local_rate(cur, to)) is not None:
+            rates[cur] = cached
+        else:
+            missing.append(cur)
+
+    for (cur, _), rate in (await _shared_rates([(cur, to) for cur in missing])).items():
+        rates[cur] = rate
+    missing = [cur for cur in missing if cur not in rates]
+    if not missing:
+        return rates
+
+    # one call quoted from `to` (?from=USD&to=EUR,GBP,...) then inverted
+    try:
+        r = await get_http().get(FX_URL, params={"from": to, "to": ",".join(sorted(missing))}, timeout=15)
+        if r.status_code == 200:
+            fetched = {}
+            for cur, inv in (orjson.loads(r.content).get("rates") or {}).items():
+                inv = float(inv)
+                if inv > 0:
+                    rates[cur] = fetched[(cur, to)] = 1.0 / inv
+            await _store_rates(fetched)
+    except Exception:
+        pass
+
+    # an unknown symbol fails the whole batch; resolve leftovers one by one
+    leftovers = [cur for cur in missing if cur not in rates]
+    if leftovers:
+        for cur, rate in zip(leftovers, await asyncio.gather(*(fx_rate(cur, to) for cur in leftovers))):
+            if rate is not None:
+                rates[cur] = rate
+    return rates
+
+async def enrich_prices_usd(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    currencies = [(it.get("price_currency") or "").upper().strip() for it in items]
+    rates = await fx_rates_for(set(currencies), "USD")
 
-def enrich_prices_usd(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     out = []
-    for it in items:
+    for it, cur in zip(items, currencies):
         v = it.get("price_value")
-        cur = (it.get("price_currency") or "").upper().strip()
         usd = None
         original = None
 
         try:
             fv = float(v)
             original = f"{fv:.2f} {cur}" if cur else f"{fv:.2f}"
-            rate = fx_rate(cur, "USD") if cur else None
+            rate = rates.get(cur)
             if rate is not None:
                 usd = fv * rate
         except Exception:
@@ -53,11 +156,7 @@ def enrich_prices_usd(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return out
 
 def average_usd(items: List[Dict[str, Any]]) -> Optional[float]:
-    prices = []
-    for it in items:
-        usd = it.get("price_usd")
-        if isinstance(usd, (int, float)):
-            prices.append(float(usd))
+    prices = [float(usd) for it in items if isinstance(usd := it.get("price_usd"), (int, float))]
     if not prices:
         return None
-    return statistics.mean(prices)
+    return statistics.fmean(prices)
@@ -0,0 +1,25 @@
+from typing import Optional
+
+import httpx
+
+# One pooled HTTP/2 client for every outbound service call (eBay, FX, Resend)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+HTTP_TIMEOUT = 30.0
+# httpx decodes both transparently (br via the brotli package); JSON shrinks 3-5x on the wire
+HTTP_HEADERS = {"Accept-Encoding": "br, gzip"}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, headers=HTTP_HEADERS)
+    return _client
+
+
+async def close_http():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from typing import Optional
 import db
 
 FREE_TOTAL_LIMIT = 5
@@ -7,7 +7,8 @@ EMAIL_DAILY_LIMIT = 10
 PAID_DAILY_LIMIT = 200
 
 def utc_day_str() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    # db caches the day string until the next UTC midnight, so this skips strftime
+    return db.utc_date_str()
 
 @dataclass
 class LimitStatus:
@@ -45,10 +46,22 @@ def check_limit(device_id: str) -> LimitStatus:
     remaining = max(0, limit - total)
     return LimitStatus(plan, remaining > 0, "OK" if remaining > 0 else "FREE_LIMIT_REACHED", remaining, limit)
 
-def register_usage(device_id: str):
+def register_usage(device_id: str) -> int:
+    """Records one use and returns the updated used count for the device's plan."""
     plan = compute_plan(device_id)
     day = utc_day_str()
     if plan in ("paid", "email"):
-        db.inc_daily_count(device_id, 1, day)
-    else:
-        db.inc_total_count(device_id, 1)
+        return db.inc_and_get_daily_count(device_id, 1, day)
+    return db.inc_and_get_total_count(device_id, 1)
+
+def consume_limit(device_id: str, plan: Optional[str] = None) -> LimitStatus:
+    """check_limit + register_usage as one conditional UPSERT, so concurrent requests cannot overshoot."""
+    plan = plan or compute_plan(device_id)
+    if plan in ("paid", "email"):
+        limit = PAID_DAILY_LIMIT if plan == "paid" else EMAIL_DAILY_LIMIT
+        allowed, remaining = db.consume_daily_count(device_id, limit, 1, utc_day_str())
+        return LimitStatus(plan, allowed, "OK" if allowed else "DAILY_LIMIT_REACHED", remaining, limit)
+
+    limit = FREE_TOTAL_LIMIT
+    allowed, remaining = db.consume_total_count(device_id, limit)
+    return LimitStatus(plan, allowed, "OK" if allowed else "FREE_LIMIT_REACHED", remaining, limit)
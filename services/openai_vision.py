@@ -1,19 +1,696 @@
-import base64
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
 import os
-from typing import List, Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from typing import TYPE_CHECKING, AsyncIterator, List, NamedTuple, Optional, Dict, Any, Tuple, Union
+
+import httpx
+import orjson
+try:
+    import blake3
+except ImportError:  # pure hashlib fallback; same 16-byte keys, just slower on big photos
+    blake3 = None
+try:
+    from pybase64 import b64encode as _b64encode  # SIMD (SSSE3/AVX2) encoder, same output
+except ImportError:
+    from base64 import b64encode as _b64encode
+
+# openai (~175ms) and Pillow are imported on first use so the app boots and answers
+# health checks before paying for them
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+VISION_MODEL = "gpt-4o-mini"
+OPENAI_TIMEOUT = 20.0
+OPENAI_MAX_RETRIES = 1
+# In-flight vision calls per process; keeps bursts under the account's RPM/TPM limits
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+# Opt-in: upload each distinct image once via the Files API and send file_id instead of base64
+VISION_USE_FILES = os.getenv("VISION_USE_FILES", "0") == "1"
+# Opt-in: coalesce sniff calls arriving within this window into one multi-item request
+VISION_BATCH_WINDOW_MS = int(os.getenv("VISION_BATCH_WINDOW_MS", "0"))
+VISION_BATCH_MAX = 8
+# Photos larger than this on the long side are downscaled before upload; 1024 keeps a
+# 4:3 phone photo within the short-side 768 the API tiles to anyway, at a fraction of the bytes
+MAX_IMAGE_SIDE = int(os.getenv("VISION_MAX_SIDE", "1024"))
+JPEG_QUALITY = 85
+# >0 moves decode/resize into that many spawned processes so uploads resize in parallel
+# outside the GIL; 0 keeps it on the default thread pool
+VISION_RESIZE_WORKERS = int(os.getenv("VISION_RESIZE_WORKERS", "0"))
+# Threads for hashing/resizing/encoding uploads; Pillow and hashlib drop the GIL for the heavy
+# parts, and a dedicated pool keeps bursts of photos off the loop's default executor
+VISION_PREP_THREADS = int(os.getenv("VISION_PREP_THREADS", str(os.cpu_count() or 4)))
+
+_call_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+
+# Один клієнт на весь процес: built on first use and rebuilt only if the key changes
+@lru_cache(maxsize=1)
+def _client_for(api_key: str) -> AsyncOpenAI:
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES,
+        # HTTP/2 multiplexes concurrent calls over a few kept-alive TLS connections
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONCURRENCY * 2, max_keepalive_connections=OPENAI_MAX_CONCURRENCY),
+        ),
+    )
+
+
+def _get_client() -> AsyncOpenAI:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY is missing in environment variables")
+    return _client_for(api_key)
+
+
+class _LRUCache:
+    """Small thread-safe LRU used for results and encoded images; entries optionally expire after ttl seconds."""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at, value); expires_at is inf when there is no ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Any, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Any):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+# LRU of model output keyed by image content + request params (retries are common);
+# entries are ~0.5KB strings, and a day-old price estimate is as far as we trust one
+RESULT_CACHE_SIZE = 2048
+RESULT_CACHE_TTL = 86400
+_result_cache = _LRUCache(RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+# Data URLs are ~1.33x the image size, so this one stays small, and only images at or under
+# DATA_URL_CACHE_MAX_BYTES (a downscaled 1024px JPEG is ~0.1-0.4MB) go in: undecodable uploads
+# pass through at up to MAX_IMAGE_BYTES and would pin hundreds of MB. Worst case ~43MB.
+DATA_URL_CACHE_SIZE = 32
+DATA_URL_CACHE_MAX_BYTES = 1_000_000
+_data_url_cache = _LRUCache(DATA_URL_CACHE_SIZE)
+
+# image digest -> uploaded file_id (only used with VISION_USE_FILES). Every upload carries a
+# server-side expiry, so files the cache evicted or forgot are deleted by the API instead of
+# piling up on the account; ids leave the cache well before their file expires
+FILE_ID_CACHE_SIZE = 1024
+FILE_ID_TTL = 3600
+FILE_EXPIRES_AFTER = 2 * FILE_ID_TTL
+_file_id_cache = _LRUCache(FILE_ID_CACHE_SIZE, ttl=FILE_ID_TTL)
+
+# Uploads arrive as memoryviews over the read buffer; hashlib/base64 take them as-is
+ImageBytes = Union[bytes, bytearray, memoryview]
+
+
+def _image_digest(image_bytes: ImageBytes) -> bytes:
+    # update() with a memoryview hashes the buffer in place instead of copying it in
+    h = blake3.blake3() if blake3 is not None else hashlib.blake2b(digest_size=16)
+    h.update(memoryview(image_bytes))
+    return h.digest(16) if blake3 is not None else h.digest()
+
+
+def _result_key(
+    digests: List[bytes],
+    hint: Optional[str],
+    asking_price: Optional[float],
+    currency: str,
+    language: str,
+) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    for d in digests:
+        h.update(d)
+    asking = round(asking_price, 2) if asking_price is not None else None
+    # the model is part of the key so switching models never serves stale answers
+    h.update(repr((VISION_MODEL, hint, asking, currency, language)).encode("utf-8"))
+    return h.digest()
+
+
+# Prefixes for the types uploads actually use, built once; others are formatted on demand
+_DATA_URL_PREFIXES = {ct: b"data:%s;base64," % ct.encode("ascii") for ct in ("image/jpeg", "image/png", "image/webp")}
+
+
+def _b64_data_url(image_bytes: ImageBytes, content_type: str = "image/jpeg") -> str:
+    prefix = _DATA_URL_PREFIXES.get(content_type) or f"data:{content_type};base64,".encode("utf-8")
+    # one bytes join, then a single ascii decode (base64 output is always ascii)
+    return (prefix + _b64encode(image_bytes)).decode("ascii")
+
+
+def _cached_data_url(image_bytes: ImageBytes, digest: bytes, content_type: str) -> str:
+    key = (digest, content_type)
+    data_url = _data_url_cache.get(key)
+    if data_url is None:
+        data_url = _b64_data_url(image_bytes, content_type)
+        if len(image_bytes) <= DATA_URL_CACHE_MAX_BYTES:
+            _data_url_cache.put(key, data_url)
+    return data_url
+
+
+# Static part of the prompt, built once at import; the JSON shape lives in _RESALE_SCHEMA
+_PROMPT = (
+    "You are Treasure Sniffer, a conservative resale assistant for EU flea markets.\n"
+    "- Identify the item in the photos; estimate resale range, risk and verdict.\n"
+    '- Resale Price Range as "$low - $high". If unsure, widen it and lower confidence.\n'
+    "- If an asking price is given, factor it into the verdict.\n"
+    "- Summary: one or two sentences of practical advice.\n"
+)
+# The schema-constrained JSON is ~80 tokens; the cap leaves room for a short summary
+MAX_OUTPUT_TOKENS = 180
+# Deterministic sampling: the same photos and context give the same verdict, which is what
+# the result cache assumes
+VISION_TEMPERATURE = 0
+# Opt-in near-duplicate cache: a request whose photos are each within SEM_CACHE_MAX_BITS of a
+# recent request's (64-bit difference hash) with the same context reuses that verdict
+SEM_CACHE = os.getenv("SEM_CACHE", "0") == "1"
+SEM_CACHE_SIZE = 1024
+SEM_CACHE_TTL = 86400
+SEM_CACHE_MAX_BITS = 6
+
+
+_LEVEL_ENUM = {"type": "string", "enum": ["low", "medium", "high"]}
+# The vision response shape; strict mode makes the model emit exactly this
+_RESALE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ui": {
+            "type": "object",
+            "properties": {
+                "fields": {
+                    "type": "object",
+                    "properties": {
+                        "Item": {"type": "string"},
+                        "Condition": {"type": "string"},
+                        "Resale Price Range": {"type": "string"},
+                        "Confidence": _LEVEL_ENUM,
+                        "Risk Level": _LEVEL_ENUM,
+                        "Verdict": {"type": "string", "enum": ["BUY", "BUY IF NEGOTIATED LOWER", "SKIP"]},
+                    },
+                    "required": ["Item", "Condition", "Resale Price Range", "Confidence", "Risk Level", "Verdict"],
+                    "additionalProperties": False,
+                },
+                "summary": {"type": "string"},
+            },
+            "required": ["fields", "summary"],
+            "additionalProperties": False,
+        },
+    },
+    "required": ["ui"],
+    "additionalProperties": False,
+}
+_TEXT_FORMAT = {"format": {"type": "json_schema", "name": "resale_verdict", "schema": _RESALE_SCHEMA, "strict": True}}
+# each batch entry names the #n it answers, so a dropped or reordered entry can't hand one
+# caller's verdict to another
+_BATCH_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {"item": {"type": "integer"}, **_RESALE_SCHEMA["properties"]},
+    "required": ["item", *_RESALE_SCHEMA["required"]],
+    "additionalProperties": False,
+}
+_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {"results": {"type": "array", "items": _BATCH_ITEM_SCHEMA}},
+    "required": ["results"],
+    "additionalProperties": False,
+}
+_BATCH_TEXT_FORMAT = {"format": {"type": "json_schema", "name": "resale_verdicts", "schema": _BATCH_SCHEMA, "strict": True}}
+_BATCH_PROMPT = _PROMPT + (
+    "Several items follow, each starting with #n and its own context and photos.\n"
+    "Return results with one entry per item, with item set to its n.\n"
+)
+
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but don't
+_JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _peek_jpeg_size(data: ImageBytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from the JPEG frame header without decoding; None if not a readable JPEG."""
+    b = memoryview(data)
+    n = len(b)
+    if n < 4 or b[0] != 0xFF or b[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= n:
+        if b[i] != 0xFF:
+            return None
+        marker = b[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone, no length
+            i += 2
+            continue
+        seg_len = (b[i + 2] << 8) | b[i + 3]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            return (b[i + 7] << 8) | b[i + 8], (b[i + 5] << 8) | b[i + 6]
+        if marker == 0xDA or seg_len < 2:  # scan data before any frame header
+            return None
+        i += 2 + seg_len
+    return None
+
+
+def _resize_for_api(image_bytes: ImageBytes, content_type: str) -> Tuple[ImageBytes, str]:
+    """Downscales oversized photos to MAX_IMAGE_SIDE as JPEG; anything else passes through."""
+    # most uploads are phone JPEGs: read the size from the header and skip Pillow when it fits
+    size = _peek_jpeg_size(image_bytes)
+    if size is not None and max(size) <= MAX_IMAGE_SIDE:
+        return image_bytes, content_type
+
+    from PIL import Image, ImageOps
+
+    # Image.open only reads the header; truncated or corrupt pixel data only fails once
+    # draft/transpose/thumbnail decode it, so the whole pipeline shares one guard
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        if max(img.size) <= MAX_IMAGE_SIDE:
+            return image_bytes, content_type
+
+        # JPEG only: libjpeg decodes straight to 1/2, 1/4 or 1/8 scale, skipping most of the IDCT
+        img.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        # re-encoding drops EXIF, so bake the phone's orientation into the pixels first
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        # the output stays a fresh buffer: its view is handed downstream and outlives this call
+        out = BytesIO()
+        # optimize=True is a second Huffman pass for ~5% smaller files; not worth it here
+        img.save(out, "JPEG", quality=JPEG_QUALITY, subsampling=2, optimize=False, progressive=False)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # not decodable: send the original bytes untouched and let the API judge them
+        return image_bytes, content_type
+    return out.getbuffer(), "image/jpeg"
+
+
+def _resize_in_worker(image_bytes: bytes, content_type: str) -> Tuple[bytes, str]:
+    # process-pool entry point: arguments and result cross a pickle boundary, so plain bytes
+    data, content_type = _resize_for_api(image_bytes, content_type)
+    return bytes(data), content_type
+
+
+def _encoded_image(image_bytes: ImageBytes, content_type: str) -> Dict[str, Any]:
+    # digest what is actually sent: smaller to hash, and uploads that downscale to the
+    # same pixels share cache entries
+    digest = _image_digest(image_bytes)
+    return {
+        "data": image_bytes,
+        "content_type": content_type,
+        "digest": digest,
+        # file_id mode never sends base64, so don't build it
+        "data_url": None if VISION_USE_FILES else _cached_data_url(image_bytes, digest, content_type),
+        "dhash": _dhash(image_bytes) if SEM_CACHE else None,
+    }
+
+
+def _dhash(image_bytes: ImageBytes) -> Optional[int]:
+    """64-bit difference hash (9x8 grayscale, left/right brightness); None if undecodable."""
+    from PIL import Image
+
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        img.draft("L", (64, 64))
+        px = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR).tobytes()
+    except Exception:
+        return None
+    h = 0
+    for row in range(0, 72, 9):
+        for col in range(row, row + 8):
+            h = (h << 1) | (px[col] > px[col + 1])
+    return h
+
+
+class _NearDupCache:
+    """Recent (context, per-photo dHash) -> raw output, matched by Hamming distance."""
+
+    def __init__(self, maxsize: int, ttl: float, max_bits: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bits = max_bits
+        # newest last: (context_key, hashes, expires_at, raw)
+        self._entries: List[Tuple[bytes, Tuple[int, ...], float, str]] = []
+        self._lock = threading.Lock()
+
+    def get(self, context_key: bytes, hashes: Tuple[int, ...]) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            for key, seen, expires_at, raw in reversed(self._entries):
+                if (
+                    key == context_key
+                    and expires_at > now
+                    and len(seen) == len(hashes)
+                    and all((a ^ b).bit_count() <= self.max_bits for a, b in zip(seen, hashes))
+                ):
+                    return raw
+        return None
+
+    def put(self, context_key: bytes, hashes: Tuple[int, ...], raw: str):
+        with self._lock:
+            self._entries.append((context_key, hashes, time.monotonic() + self.ttl, raw))
+            if len(self._entries) > self.maxsize:
+                del self._entries[: len(self._entries) - self.maxsize]
+
+
+_near_dup_cache = _NearDupCache(SEM_CACHE_SIZE, SEM_CACHE_TTL, SEM_CACHE_MAX_BITS)
+
+
+def prepare_image(image_bytes: ImageBytes, content_type: str = "image/jpeg") -> Dict[str, Any]:
+    """Hashes, downscales and encodes one image up front; safe to run in a worker thread per upload."""
+    image_bytes, content_type = _resize_for_api(image_bytes, content_type)
+    return _encoded_image(image_bytes, content_type)
+
+
+_resize_pool: Optional[ProcessPoolExecutor] = None
+_prep_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_resize_pool() -> Optional[ProcessPoolExecutor]:
+    global _resize_pool
+    if _resize_pool is None and VISION_RESIZE_WORKERS > 0:
+        # spawn, not fork: the server process already runs threads (vision-prep pool, the
+        # loop's default executor), and forking with their locks held can deadlock the child
+        _resize_pool = ProcessPoolExecutor(
+            max_workers=VISION_RESIZE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _resize_pool
+
+
+def _get_prep_pool() -> ThreadPoolExecutor:
+    global _prep_pool
+    if _prep_pool is None:
+        _prep_pool = ThreadPoolExecutor(max_workers=VISION_PREP_THREADS, thread_name_prefix="vision-prep")
+    return _prep_pool
+
 
-from openai import OpenAI
+def shutdown_image_pools():
+    global _resize_pool, _prep_pool
+    if _resize_pool is not None:
+        _resize_pool.shutdown(cancel_futures=True)
+        _resize_pool = None
+    if _prep_pool is not None:
+        _prep_pool.shutdown(cancel_futures=True)
+        _prep_pool = None
 
-# Один клієнт на весь процес
-_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+async def prepare_image_async(image_bytes: ImageBytes, content_type: str = "image/jpeg") -> Dict[str, Any]:
+    """prepare_image off the event loop; the resize runs in the process pool when one is configured."""
+    loop = asyncio.get_running_loop()
+    pool = _get_resize_pool()
+    if pool is None:
+        return await loop.run_in_executor(_get_prep_pool(), prepare_image, image_bytes, content_type)
 
-def _b64_data_url(image_bytes: bytes, content_type: str = "image/jpeg") -> str:
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
-    return f"data:{content_type};base64,{b64}"
+    data, content_type = await loop.run_in_executor(pool, _resize_in_worker, bytes(image_bytes), content_type)
+    return await loop.run_in_executor(_get_prep_pool(), _encoded_image, data, content_type)
 
 
-def vision_quick_sniff(
+def _near_dup_key(
+    images: List[Dict[str, Any]],
+    hint: Optional[str],
+    asking_price: Optional[float],
+    currency: str,
+    language: str,
+) -> Optional[Tuple[bytes, Tuple[int, ...]]]:
+    # (context-only cache key, photo hashes), or None when off or a photo has no hash
+    if not SEM_CACHE:
+        return None
+    hashes = tuple(img.get("dhash") for img in images)
+    if not hashes or None in hashes:
+        return None
+    return _result_key([], hint, asking_price, currency, language), hashes
+
+
+def _request_key(
+    images: List[Dict[str, Any]],
+    hint: Optional[str],
+    asking_price: Optional[float],
+    currency: str,
+    language: str,
+) -> Tuple[List[Dict[str, Any]], List[bytes], bytes]:
+    # identical photos (double-picked, same thumbnail twice) are sent once: no extra
+    # encoding, upload or image tokens, and the cache key ignores the repeats
+    unique: List[Dict[str, Any]] = []
+    digests: List[bytes] = []
+    for img in images:
+        digest = img.get("digest") or _image_digest(img["data"])
+        if digest not in digests:
+            unique.append(img)
+            digests.append(digest)
+    return unique, digests, _result_key(digests, hint, asking_price, currency, language)
+
+
+async def _file_id(client: AsyncOpenAI, img: Dict[str, Any], digest: bytes) -> str:
+    file_id = _file_id_cache.get(digest)
+    if file_id is None:
+        content_type = img.get("content_type") or "image/jpeg"
+        name = f"{digest.hex()}.{content_type.rpartition('/')[2] or 'jpg'}"
+        uploaded = await client.files.create(
+            file=(name, bytes(img["data"]), content_type),
+            purpose="vision",
+            expires_after={"anchor": "created_at", "seconds": FILE_EXPIRES_AFTER},
+        )
+        file_id = uploaded.id
+        _file_id_cache.put(digest, file_id)
+    return file_id
+
+
+async def _image_parts(client: AsyncOpenAI, images: List[Dict[str, Any]], digests: List[bytes]) -> List[Dict[str, Any]]:
+    # Build image parts for Responses API
+    if VISION_USE_FILES:
+        file_ids = await asyncio.gather(*(_file_id(client, img, d) for img, d in zip(images, digests)))
+        return [{"type": "input_image", "file_id": file_id} for file_id in file_ids]
+
+    image_parts = []
+    for img, digest in zip(images, digests):
+        data_url = img.get("data_url") or _cached_data_url(img["data"], digest, img.get("content_type") or "image/jpeg")
+        image_parts.append({"type": "input_image", "image_url": data_url})
+    return image_parts
+
+
+def _user_context(
+    hint: Optional[str],
+    asking_price: Optional[float],
+    currency: str,
+    language: str,
+) -> str:
+    # Keep prompt tight and deterministic; JSON keeps a free-text hint from bleeding into the rules
+    user_context: Dict[str, Any] = {}
+    if hint:
+        user_context["hint"] = hint
+    if asking_price is not None:
+        user_context["asking_price"] = asking_price
+        user_context["currency"] = currency
+    user_context["language"] = language
+    return "User context: " + orjson.dumps(user_context).decode("utf-8")
+
+
+# (text, images, digests): one text part followed by that item's photos
+_Group = Tuple[str, List[Dict[str, Any]], List[bytes]]
+
+
+async def _create_response(
+    client: AsyncOpenAI,
+    groups: List[_Group],
+    instructions: str = _PROMPT,
+    text_format: Dict[str, Any] = _TEXT_FORMAT,
+    max_output_tokens: int = MAX_OUTPUT_TOKENS,
+    **kwargs: Any,
+) -> Any:
+    """responses.create for the groups; re-uploads once if a cached file_id has expired upstream."""
+    from openai import NotFoundError
+
+    for attempt in (0, 1):
+        content = []
+        for text, images, digests in groups:
+            content.append({"type": "input_text", "text": text})
+            content += await _image_parts(client, images, digests)
+        try:
+            return await client.responses.create(
+                model=VISION_MODEL,
+                # static rules go in instructions, ahead of the per-request input, so the
+                # shared prefix is identical across calls and eligible for prompt caching
+                instructions=instructions,
+                input=[{"role": "user", "content": content}],
+                text=text_format,
+                max_output_tokens=max_output_tokens,
+                temperature=VISION_TEMPERATURE,
+                **kwargs,
+            )
+        except NotFoundError:
+            if not VISION_USE_FILES or attempt:
+                raise
+            for _, _, digests in groups:
+                for digest in digests:
+                    _file_id_cache.pop(digest)
+
+
+# (raw output text, whether the response ran to completion)
+_Sniffed = Tuple[str, bool]
+
+
+async def _sniff_once(client: AsyncOpenAI, images: List[Dict[str, Any]], digests: List[bytes], context: str) -> _Sniffed:
+    async with _call_slots:
+        resp = await _create_response(client, [(context, images, digests)])
+    # Responses API returns text in output_text helper; "incomplete" means it hit the token cap
+    return resp.output_text, resp.status == "completed"
+
+
+class _MicroBatcher:
+    """Coalesces sniff requests that arrive within a short window into one multi-item call."""
+
+    def __init__(self, window_s: float, max_items: int):
+        self.window_s = window_s
+        self.max_items = max_items
+        self._pending: List[Tuple[AsyncOpenAI, List[Dict[str, Any]], List[bytes], str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit(self, client: AsyncOpenAI, images: List[Dict[str, Any]], digests: List[bytes], context: str) -> _Sniffed:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((client, images, digests, context, fut))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            # keep a reference until done, or the task can be garbage-collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            if len(batch) == 1:
+                client, images, digests, context, fut = batch[0]
+                raws = [await _sniff_once(client, images, digests, context)]
+            else:
+                raws = await self._run_many(batch)
+        except Exception as e:
+            for *_, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (*_, fut), raw in zip(batch, raws):
+            if not fut.done():
+                fut.set_result(raw)
+
+    async def _run_many(self, batch) -> List[_Sniffed]:
+        client = batch[0][0]
+        groups = [(f"#{n}\n{context}", images, digests) for n, (_, images, digests, context, _) in enumerate(batch, 1)]
+        async with _call_slots:
+            resp = await _create_response(
+                client,
+                groups,
+                instructions=_BATCH_PROMPT,
+                text_format=_BATCH_TEXT_FORMAT,
+                max_output_tokens=MAX_OUTPUT_TOKENS * len(batch),
+            )
+        try:
+            results = orjson.loads(resp.output_text)["results"]
+        except (ValueError, KeyError, TypeError):
+            results = []
+        completed = resp.status == "completed"
+        # match by the item number, never by position; the first answer for an #n wins
+        raws: List[Optional[_Sniffed]] = [None] * len(batch)
+        for r in results:
+            n = r.get("item") if isinstance(r, dict) else None
+            if isinstance(n, int) and 1 <= n <= len(batch) and raws[n - 1] is None:
+                raws[n - 1] = (orjson.dumps({"ui": r.get("ui")}).decode("utf-8"), completed)
+        # anything the model dropped or mislabelled goes out on its own, side by side
+        missing = [i for i, raw in enumerate(raws) if raw is None]
+        resent = await asyncio.gather(
+            *(_sniff_once(client, images, digests, context) for _, images, digests, context, _ in (batch[i] for i in missing))
+        )
+        for i, raw in zip(missing, resent):
+            raws[i] = raw
+        return raws
+
+
+_batcher = _MicroBatcher(VISION_BATCH_WINDOW_MS / 1000, VISION_BATCH_MAX) if VISION_BATCH_WINDOW_MS > 0 else None
+
+
+class _SniffRequest(NamedTuple):
+    client: AsyncOpenAI
+    images: List[Dict[str, Any]]
+    digests: List[bytes]
+    cache_key: bytes
+    near: Optional[Tuple[bytes, Tuple[int, ...]]]
+    context: str
+
+
+def _sniff_request(
+    images: List[Dict[str, Any]],
+    hint: Optional[str],
+    asking_price: Optional[float],
+    currency: str,
+    language: str,
+) -> Tuple[_SniffRequest, Optional[str]]:
+    """Shared front half of every sniff: dedupe + keys, then the exact and near-dup caches."""
+    client = _get_client()
+    images, digests, cache_key = _request_key(images, hint, asking_price, currency, language)
+    near = _near_dup_key(images, hint, asking_price, currency, language)
+    cached = _result_cache.get(cache_key)
+    if cached is None and near is not None:
+        cached = _near_dup_cache.get(*near)
+    context = _user_context(hint, asking_price, currency, language) if cached is None else ""
+    return _SniffRequest(client, images, digests, cache_key, near, context), cached
+
+
+def _is_verdict(raw: str) -> bool:
+    try:
+        return isinstance(orjson.loads(raw), dict)
+    except ValueError:
+        return False
+
+
+def _remember(req: _SniffRequest, raw: str, completed: bool):
+    # truncated or unparseable output would replay the parse fallback for a whole TTL
+    if completed and _is_verdict(raw):
+        _result_cache.put(req.cache_key, raw)
+        if req.near is not None:
+            _near_dup_cache.put(*req.near, raw)
+
+
+async def vision_quick_sniff(
     images: List[Dict[str, Any]],
     hint: Optional[str] = None,
     asking_price: Optional[float] = None,
@@ -21,55 +698,88 @@ def vision_quick_sniff(
     language: str = "en",
 ) -> str:
     """
-    images: list of { "data": bytes, "content_type": "image/jpeg" }
+    images: list of { "data": bytes | memoryview, "content_type": "image/jpeg" },
+            optionally already run through prepare_image()
     returns: raw text from model (we'll parse JSON outside if you do)
     """
 
-    if not os.getenv("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is missing in environment variables")
+    req, cached = _sniff_request(images, hint, asking_price, currency, language)
+    if cached is not None:
+        return cached
 
-    # Build image parts for Responses API
-    image_parts = []
-    for img in images:
-        data_url = _b64_data_url(img["data"], img.get("content_type") or "image/jpeg")
-        image_parts.append({"type": "input_image", "image_url": data_url})
+    if _batcher is not None:
+        raw, completed = await _batcher.submit(req.client, req.images, req.digests, req.context)
+    else:
+        raw, completed = await _sniff_once(req.client, req.images, req.digests, req.context)
+    _remember(req, raw, completed)
+    return raw
 
-    # Keep prompt tight and deterministic
-    user_context = []
-    if hint:
-        user_context.append(f"Hint: {hint}")
-    if asking_price is not None:
-        user_context.append(f"Asking price: {asking_price} {currency}")
-    user_context.append(f"Language: {language}")
-
-    prompt = (
-        "Return ONLY valid JSON. No markdown.\n"
-        "You are Treasure Sniffer: a conservative resale assistant for EU flea markets.\n"
-        "Analyze the item from the photos, estimate resale range, risk, and verdict.\n"
-        "Be conservative. If unsure, widen range and lower confidence.\n"
-        "If asking price is provided, incorporate it into the verdict.\n"
-        "Output JSON shape:\n"
-        "{\n"
-        '  "ui": {\n'
-        '    "fields": {\n'
-        '      "Item": "...",\n'
-        '      "Condition": "...",\n'
-        '      "Resale Price Range": "$low - $high",\n'
-        '      "Confidence": "low|medium|high",\n'
-        '      "Risk Level": "low|medium|high",\n'
-        '      "Verdict": "BUY|BUY IF NEGOTIATED LOWER|SKIP"\n'
-        "    },\n"
-        '    "summary": "short practical advice"\n'
-        "  }\n"
-        "}\n"
-    )
 
-    content = [{"type": "input_text", "text": prompt + "\n" + "\n".join(user_context)}] + image_parts
+class _ObjectCloseTracker:
+    """Follows brace depth across streamed chunks (string-aware); feed() is True once the top-level object closes."""
 
-    resp = _client.responses.create(
-        model="gpt-4o-mini",
-        input=[{"role": "user", "content": content}],
-    )
+    __slots__ = ("depth", "in_str", "escaped")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_str = False
+        self.escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        for ch in chunk:
+            if self.in_str:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+
+async def vision_quick_sniff_stream(
+    images: List[Dict[str, Any]],
+    hint: Optional[str] = None,
+    asking_price: Optional[float] = None,
+    currency: str = "USD",
+    language: str = "en",
+) -> AsyncIterator[str]:
+    """
+    Same request as vision_quick_sniff, but yields output text deltas as the model
+    produces them. A cached result is yielded as a single chunk. Never batched.
+    """
+
+    req, cached = _sniff_request(images, hint, asking_price, currency, language)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    closed = _ObjectCloseTracker()
+    completed = False
+    # the slot is held for the whole stream, since the request is in flight until it ends
+    async with _call_slots:
+        stream = await _create_response(req.client, [(req.context, req.images, req.digests)], stream=True)
+        # closed on every exit, including a client disconnect (GeneratorExit at the yield),
+        # so the upstream generation never outlives the request
+        try:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    parts.append(event.delta)
+                    yield event.delta
+                    # the object is complete; don't wait for the trailing events and usage frame
+                    if closed.feed(event.delta):
+                        completed = True
+                        break
+        finally:
+            await stream.close()
 
-    # Responses API returns text in output_text helper
-    return resp.output_text
+    _remember(req, "".join(parts), completed)
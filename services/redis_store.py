@@ -0,0 +1,25 @@
+import os
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+# Redis is optional: without REDIS_URL every caller falls back to process-local/SQLite state
+REDIS_URL = (os.getenv("REDIS_URL") or "").strip()
+
+_async_client: Optional[aioredis.Redis] = None
+
+
+def get_async_redis() -> Optional[aioredis.Redis]:
+    global _async_client
+    if not REDIS_URL:
+        return None
+    if _async_client is None:
+        _async_client = aioredis.from_url(REDIS_URL, decode_responses=True)
+    return _async_client
+
+
+async def close_redis():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
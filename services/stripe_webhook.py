@@ -1,23 +1,56 @@
+import asyncio
+import logging
 import os
 import secrets
 import stripe
 
 import db
-from services.emailer import send_email
+from services.emailer import send_email, send_in_background
+
+log = logging.getLogger(__name__)
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "").strip()
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "").strip()
 PRODUCT_NAME = os.getenv("PRODUCT_NAME", "Flea Assistant Pro ($10)").strip()
 
+# the key never changes at runtime, so set it once instead of on every webhook
+if STRIPE_SECRET_KEY:
+    stripe.api_key = STRIPE_SECRET_KEY
+
+EMAIL_SUBJECT = "Your Flea Assistant Pro key"
+EMAIL_TEMPLATE = """Thanks for purchasing {product}!
+
+Your license key:
+{key}
+
+How to activate (1 device):
+1) Open the app
+2) Paste the license key in the “Activate Pro” field
+3) Done — Pro is now bound to this device
+
+— Flea Assistant
+"""
+
+EMAIL_ATTEMPTS = 2
+
+async def _deliver_license_email(license_key: str, email: str, subject: str, text: str) -> None:
+    # runs after the 200 went back to Stripe, so the outcome lands on the license row
+    for attempt in range(1, EMAIL_ATTEMPTS + 1):
+        ok, status = await send_email(email, subject, text)
+        if ok:
+            await asyncio.to_thread(db.set_license_email_status, license_key, "sent")
+            return
+        # the status code part only: provider error bodies can echo the address back
+        log.warning("license email failed (attempt %d/%d): %s", attempt, EMAIL_ATTEMPTS, status.split(":", 1)[0])
+    await asyncio.to_thread(db.set_license_email_status, license_key, "failed")
+
 def _make_license_key() -> str:
-    return "FA-" + secrets.token_hex(8).upper()
+    return f"FA-{secrets.token_bytes(8).hex().upper()}"
 
-def handle_stripe_webhook(payload: bytes, sig_header: str | None) -> tuple[int, dict]:
+async def handle_stripe_webhook(payload: bytes, sig_header: str | None) -> tuple[int, dict]:
     if not STRIPE_SECRET_KEY or not STRIPE_WEBHOOK_SECRET:
         return 503, {"ok": False, "error": "Stripe not configured (missing STRIPE_SECRET_KEY / STRIPE_WEBHOOK_SECRET)"}
 
-    stripe.api_key = STRIPE_SECRET_KEY
-
     try:
         event = stripe.Webhook.construct_event(payload=payload, sig_header=sig_header, secret=STRIPE_WEBHOOK_SECRET)
     except Exception as e:
@@ -30,22 +63,12 @@ def handle_stripe_webhook(payload: bytes, sig_header: str | None) -> tuple[int,
             return 200, {"ok": True, "note": "No email in session"}
 
         license_key = _make_license_key()
-        db.create_license(license_key=license_key, email=email, plan="paid")
-
-        subject = "Your Flea Assistant Pro key"
-        text = f"""Thanks for purchasing {PRODUCT_NAME}!
-
-Your license key:
-{license_key}
+        await asyncio.to_thread(db.create_license, license_key=license_key, email=email, plan="paid")
 
-How to activate (1 device):
-1) Open the app
-2) Paste the license key in the “Activate Pro” field
-3) Done — Pro is now bound to this device
-
-— Flea Assistant
-"""
-        ok, status = send_email(email, subject, text)
-        return 200, {"ok": True, "created_license": True, "email_status": status}
+        text = EMAIL_TEMPLATE.format_map({"product": PRODUCT_NAME, "key": license_key})
+        # the license row is what matters for Stripe; the mail round trip shouldn't hold the
+        # 200 back long enough to trigger a retry
+        send_in_background(_deliver_license_email(license_key, email, EMAIL_SUBJECT, text))
+        return 200, {"ok": True, "created_license": True, "email_status": "queued"}
 
     return 200, {"ok": True, "ignored": event["type"]}